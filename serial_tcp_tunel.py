@@ -1,44 +1,214 @@
+import collections
+import itertools
+import os
+import re
+import select
+import selectors
+import signal
 import serial
 import serial.tools.list_ports
 import socket
 import threading
 import sys
 import time
+from dataclasses import dataclass, field
+from typing import Optional
 
 # --- Configurações Padrão ---
 BAUDRATE = 115200 # Ajuste conforme o seu dispositivo
 TCP_HOST = '0.0.0.0'  # Escuta em todas as interfaces
 TCP_PORT = 5558
+TELNET_FILTER = False  # Remove a negociação Telnet do cliente; o protocolo Speeduino é binário e não a usa
+SERIAL_TIMEOUT = 0.05  # Tempo máximo (s) que a leitura serial fica bloqueada
+TX_BATCH_SIZE = 4096     # Máximo de bytes acumulados antes de enviar ao TCP
+TX_BATCH_WINDOW = 0.002  # Tempo máximo (s) acumulando bytes antes de enviar ao TCP
+TCP_BUFFER_SIZE = 65536  # Tamanho dos buffers de envio/recepção do socket do cliente
+SERIAL_DRAIN_MAX = 65536 # Máximo de bytes lidos da serial em uma iteração do loop de eventos
+RECV_BUFFER_SIZE = 4096  # Tamanho do buffer reutilizado para receber dados do cliente
+STATUS_INTERVAL = 0.1    # Intervalo mínimo (s) entre atualizações da linha de status
+ACCEPT_BACKLOG = 4       # Conexões pendentes enfileiradas pelo kernel (excedentes são recusadas)
+TX_HIGH_WATER = 262144   # Bytes na fila Serial -> TCP a partir dos quais a leitura serial é pausada
+
+# Limite de blocos por chamada sendmsg (bem abaixo do IOV_MAX dos sistemas POSIX)
+_SENDMSG_MAX_BUFFERS = 64
+
+# Separadores do menu e dos resumos no terminal
+_HR = "=" * 60
+_SEP = "-" * 60
+
+# Sequências Telnet: negociação IAC (0xFF) + WILL/WONT/DO/DONT + opção, ou IAC escapado (0xFF 0xFF)
+_IAC_RE = re.compile(rb'\xff(?:[\xfb-\xfe].|\xff)', re.DOTALL)
+
+def _iac_replacement(match):
+    """Descarta a negociação Telnet e converte o IAC escapado de volta em um único 0xFF."""
+    return b'\xff' if match.group() == b'\xff\xff' else b''
+
+@dataclass
+class TunnelState:
+    """Estado do túnel compartilhado entre o loop de aceitação e a thread do cliente."""
+    ser: serial.Serial
+    serial_fd: Optional[int] = None  # None quando a plataforma não expõe o descritor (ex.: Windows)
+    shutdown: threading.Event = field(default_factory=threading.Event)  # Sinaliza o encerramento das threads
+    conn: Optional[socket.socket] = None
+    addr: Optional[tuple] = None
+    telnet_filter: bool = TELNET_FILTER
+
+@dataclass
+class TransferStatus:
+    """Total de bytes de um sentido do túnel, exibido no máximo a cada STATUS_INTERVAL."""
+    template: str  # Formatado com o total de bytes transferidos na conexão
+    last_print: float = 0.0
+    total: int = 0
+    printed: int = 0  # Total exibido na última atualização
+
+    def add(self, count):
+        """Contabiliza os bytes transferidos e atualiza a linha se o intervalo já passou."""
+        self.total += count
+        now = time.monotonic()
+        if now - self.last_print >= STATUS_INTERVAL:
+            self._print(now)
+
+    def flush(self):
+        """Exibe o total final, caso a última atualização tenha sido adiada pelo intervalo."""
+        if self.total != self.printed:
+            self._print(time.monotonic())
+
+    def _print(self, now):
+        sys.stdout.write(self.template.format(self.total))
+        sys.stdout.flush()
+        self.last_print = now
+        self.printed = self.total
+
+def _serial_fileno(port):
+    """Retorna o descritor de arquivo da porta serial, ou None se não estiver disponível."""
+    try:
+        return port.fileno()
+    except (AttributeError, OSError):
+        return None
 
-# Variáveis globais para a conexão
-ser = None
-tcp_socket = None
-client_address = None
-is_running = True
-
-def serial_to_tcp():
-    """Lê da porta serial e envia para o socket TCP."""
-    global is_running
+def _read_serial_fd(fd):
+    """Lê tudo o que já estiver disponível no descritor da porta serial."""
+    try:
+        data = os.read(fd, TX_BATCH_SIZE)
+    except BlockingIOError:
+        return b''
+    except OSError as e:
+        raise serial.SerialException(f"falha na leitura: {e}")
+    if not data:
+        # Dispositivos desconectados ficam sempre "prontos", mas não retornam dados
+        raise serial.SerialException("a porta indicou dados disponíveis mas não retornou nada (dispositivo desconectado?)")
+    return data
+
+def _read_serial_fd_chunks(fd):
+    """Lê os blocos pendentes no descritor da porta serial, até SERIAL_DRAIN_MAX bytes."""
+    chunks = []
+    total = 0
+    while total < SERIAL_DRAIN_MAX:
+        data = _read_serial_fd(fd)
+        if not data:
+            break
+        chunks.append(data)
+        total += len(data)
+        # Um bloco menor que o máximo indica que o buffer do driver foi esvaziado
+        if len(data) < TX_BATCH_SIZE:
+            break
+    return chunks
+
+def _read_serial_pyserial(ser):
+    """Lê da porta serial via pyserial (plataformas sem descritor de arquivo, ex.: Windows)."""
+    # Bloqueia no kernel até chegar o primeiro byte (ou expirar o timeout)
+    data = ser.read(1)
+    if not data:
+        return data
+    buf = bytearray(data)
+
+    # Acumula os bytes que continuarem chegando, limitado por tamanho e tempo,
+    # para enviar tudo em um único sendall
+    batch_start = time.monotonic()
+    while len(buf) < TX_BATCH_SIZE and time.monotonic() - batch_start < TX_BATCH_WINDOW:
+        extra = ser.in_waiting
+        if not extra:
+            break
+        buf += ser.read(min(extra, TX_BATCH_SIZE - len(buf)))
+    return buf
+
+def _write_serial(state, data):
+    """Escreve todos os bytes na porta serial, aguardando quando o buffer do driver enche."""
+    fd = state.serial_fd
+    if fd is None:
+        state.ser.write(data)
+        return
+    view = memoryview(data)
+    while view:
+        try:
+            written = os.write(fd, view)
+        except BlockingIOError:
+            # A porta é aberta em modo não bloqueante: espera até poder escrever
+            select.select([], [fd], [])
+            continue
+        except OSError as e:
+            raise serial.SerialException(f"falha na escrita: {e}")
+        view = view[written:]
+
+def _send_to_tcp(conn, data, status):
+    """Envia ao cliente TCP os dados lidos da porta serial."""
+    conn.sendall(data)
+    status.add(len(data))
+
+def _flush_tx_queue(conn, tx_queue, status):
+    """Envia ao cliente TCP o máximo possível da fila, sem bloquear. Retorna quantos bytes saíram."""
+    try:
+        # Vários blocos em uma única chamada sendmsg (scatter/gather)
+        sent = conn.sendmsg(list(itertools.islice(tx_queue, _SENDMSG_MAX_BUFFERS)))
+    except BlockingIOError:
+        return 0
+    status.add(sent)
+
+    remaining = sent
+    while remaining:
+        head = tx_queue[0]
+        if len(head) > remaining:
+            # Envio parcial: avança a visão do primeiro bloco, sem copiar
+            tx_queue[0] = head[remaining:]
+            break
+        tx_queue.popleft()
+        remaining -= len(head)
+    return sent
+
+def _tcp_to_serial(state, conn, rx_view, status):
+    """Repassa um bloco recebido do cliente TCP para a porta serial. Retorna False se o cliente desconectou."""
+    # Recebe os dados do cliente TCP direto no buffer pré-alocado, sem criar um novo objeto bytes
+    try:
+        received = conn.recv_into(rx_view)
+    except BlockingIOError:
+        return True  # Socket não bloqueante ainda sem dados
+    if not received:
+        return False
+    data_to_write = rx_view[:received]
+    # Com o filtro Telnet ativo, remove a negociação IAC. Sem nenhum byte 0xFF (caso comum)
+    # a busca no bytearray subjacente basta e a própria fatia é repassada, sem cópia
+    if state.telnet_filter and rx_view.obj.find(0xFF, 0, received) != -1:
+        data_to_write = _IAC_RE.sub(_iac_replacement, data_to_write)
+    # Envia os dados recebidos do TCP para a porta Serial
+    _write_serial(state, data_to_write)
+    status.add(received)
+    return True
+
+def serial_to_tcp(state, conn, status):
+    """Lê da porta serial via pyserial e envia para o socket TCP (usado quando não há descritor da porta)."""
     print(f"[{threading.current_thread().name}] Thread para leitura Serial iniciada.")
     try:
-        while is_running and tcp_socket:
-            if ser.in_waiting > 0:
-                # Lê todos os bytes disponíveis
-                data = ser.read(ser.in_waiting)
-                
-                # Envia os dados brutos para o socket TCP
-                # Certifique-se de que os dados são do tipo bytes
-                if data:
-                    try:
-                        tcp_socket.sendall(data)
-                        sys.stdout.write(f"\r[Serial -> TCP] Enviado {len(data)} bytes para {client_address[0]}:{client_address[1]}")
-                        sys.stdout.flush()
-                    except socket.error as e:
-                        print(f"\n[ERRO TCP] Falha ao enviar dados para o cliente: {e}")
-                        break  # Sai do loop para fechar a conexão
-            
-            # Pequena pausa para evitar alto uso da CPU
-            time.sleep(0.001)
+        # Encerra quando o túnel para ou quando este cliente deixa de ser o conectado
+        while not state.shutdown.is_set() and state.conn is conn:
+            data = _read_serial_pyserial(state.ser)
+            if not data:
+                continue
+
+            try:
+                _send_to_tcp(conn, data, status)
+            except socket.error as e:
+                print(f"\n[ERRO TCP] Falha ao enviar dados para o cliente: {e}")
+                break  # Sai do loop para fechar a conexão
 
     except serial.SerialException as e:
         print(f"\n[ERRO SERIAL] Falha de comunicação serial: {e}")
@@ -48,93 +218,155 @@ def serial_to_tcp():
         print(f"\n[{threading.current_thread().name}] Thread de leitura Serial finalizada.")
         # O encerramento da conexão será tratado no loop principal.
 
+def _tunnel_select(state, conn, rx_view, to_tcp, to_serial):
+    """Encaminha os dois sentidos em um único loop de eventos sobre a porta serial e o socket."""
+    serial_fd = state.serial_fd
+    # Dados da serial aguardando espaço no socket; um cliente lento não bloqueia o loop
+    tx_queue = collections.deque()
+    tx_bytes = 0
+    conn.setblocking(False)
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(serial_fd, selectors.EVENT_READ)
+        selector.register(conn, selectors.EVENT_READ)
+        conn_events = selectors.EVENT_READ
+        serial_paused = False
+
+        while not state.shutdown.is_set():
+            for key, events in selector.select():
+                if key.fileobj is conn:
+                    if events & selectors.EVENT_READ and not _tcp_to_serial(state, conn, rx_view, to_serial):
+                        return  # Cliente desconectou
+                    if events & selectors.EVENT_WRITE:
+                        tx_bytes -= _flush_tx_queue(conn, tx_queue, to_tcp)
+                else:
+                    was_empty = not tx_queue
+                    for chunk in _read_serial_fd_chunks(serial_fd):
+                        tx_queue.append(memoryview(chunk))
+                        tx_bytes += len(chunk)
+                    # Com a fila vazia tenta enviar já; o que sobrar aguarda o socket ficar livre
+                    if was_empty and tx_queue:
+                        tx_bytes -= _flush_tx_queue(conn, tx_queue, to_tcp)
+
+            # Monitora a escrita no socket apenas enquanto houver dados na fila
+            wanted = selectors.EVENT_READ | (selectors.EVENT_WRITE if tx_queue else 0)
+            if wanted != conn_events:
+                selector.modify(conn, wanted)
+                conn_events = wanted
+
+            # Fila acima do limite: para de ler a serial até o cliente consumir os dados
+            pause = tx_bytes >= TX_HIGH_WATER
+            if pause != serial_paused:
+                if pause:
+                    selector.unregister(serial_fd)
+                else:
+                    selector.register(serial_fd, selectors.EVENT_READ)
+                serial_paused = pause
 
-def handle_tcp_client(conn, addr):
-    """Gerencia a conexão do cliente TCP."""
-    global tcp_socket, client_address, is_running
-    tcp_socket = conn
-    client_address = addr
-
-    print(f"\n[TCP] Conexão estabelecida com {addr[0]}:{addr[1]}")
-    
+def _tunnel_threaded(state, conn, rx_view, to_tcp, to_serial):
+    """Encaminha os dois sentidos usando uma thread dedicada para a leitura serial."""
     # Inicia a thread para enviar dados da Serial para o TCP
-    serial_thread = threading.Thread(target=serial_to_tcp, name="SerialToTCP")
+    serial_thread = threading.Thread(target=serial_to_tcp, args=(state, conn, to_tcp), name="SerialToTCP")
     serial_thread.daemon = True # Permite que o programa principal saia mesmo com a thread rodando
     serial_thread.start()
 
+    while not state.shutdown.is_set():
+        if not _tcp_to_serial(state, conn, rx_view, to_serial):
+            break  # Cliente desconectou
+
+def run_tunnel(state):
+    """Gerencia a conexão do cliente TCP, encaminhando dados entre ele e a porta serial."""
+    conn, addr = state.conn, state.addr
+
+    print(f"\n[TCP] Conexão estabelecida com {addr[0]}:{addr[1]}")
+
+    # Buffer de recepção reutilizado durante toda a conexão
+    rx_view = memoryview(bytearray(RECV_BUFFER_SIZE))
+    peer = f"{addr[0]}:{addr[1]}"
+    to_tcp = TransferStatus("\r[Serial -> TCP] Total enviado: {} bytes para " + peer)
+    to_serial = TransferStatus("\r[TCP -> Serial] Total recebido: {} bytes de " + peer)
+
     try:
-        while is_running:
-            # Recebe dados do cliente TCP (buffer de 4096 bytes)
-            data = conn.recv(4096)
-            
-            if not data:
-                # Cliente desconectou
-                break
-            filtered_data = bytearray()
-            i = 0
-            while i < len(data):
-                byte = data[i]
-                if byte == 0xFF:  # 0xFF é o IAC (Interpret as Command)
-                    # Se for IAC, pula os próximos 2 bytes que são o comando e a opção
-                    i += 3 
-                else:
-                    filtered_data.append(byte)
-                    i += 1
-            
-            data_to_write = bytes(filtered_data)
-            # Envia os dados brutos recebidos do TCP para a porta Serial
-            ser.write(data)
-            sys.stdout.write(f"\r[TCP -> Serial] Recebido {len(data)} bytes de {addr[0]}:{addr[1]}")
-            sys.stdout.flush()
+        # Desativa o algoritmo de Nagle (mensagens pequenas de telemetria) e amplia os buffers.
+        # Dentro do try: se falhar (ex.: conexão já resetada), o finally libera o cliente
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TCP_BUFFER_SIZE)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TCP_BUFFER_SIZE)
+
+        if state.serial_fd is not None:
+            _tunnel_select(state, conn, rx_view, to_tcp, to_serial)
+        else:
+            # Sem descritor da porta (ex.: Windows) não é possível aguardar os dois lados juntos
+            _tunnel_threaded(state, conn, rx_view, to_tcp, to_serial)
 
+    except serial.SerialException as e:
+        print(f"\n[ERRO SERIAL] Falha de comunicação serial: {e}")
     except socket.error as e:
         print(f"\n[ERRO TCP] Conexão com o cliente perdida: {e}")
-    except serial.SerialException as e:
-        print(f"\n[ERRO SERIAL] Falha ao escrever na porta serial: {e}")
     except Exception as e:
-        print(f"\n[ERRO] Ocorreu um erro na thread handle_tcp_client: {e}")
+        print(f"\n[ERRO] Ocorreu um erro na thread run_tunnel: {e}")
     finally:
-        # Limpeza da conexão TCP e encerramento da thread serial
+        # Mostra os totais que ficaram pendentes pelo limite de atualização
+        to_serial.flush()
+        to_tcp.flush()
+
+        # Limpeza da conexão TCP (encerra também a thread serial, quando existir)
         print(f"\n[TCP] Conexão com {addr[0]}:{addr[1]} encerrada. Fechando socket...")
-        tcp_socket.close()
-        tcp_socket = None
-        client_address = None
-        # A thread serial_to_tcp irá naturalmente terminar no próximo ciclo.
+        conn.close()
+        state.conn = None
+        state.addr = None
 
 def listar_portas_com():
     """Lista todas as portas COM disponíveis no sistema."""
     portas = serial.tools.list_ports.comports()
     return sorted(portas, key=lambda p: p.device)
 
-def exibir_menu_portas():
-    """Exibe menu interativo para seleção da porta COM."""
-    print("\n" + "="*60)
-    print("  SPEEDUINO TCP PROXY - Configuração")
-    print("="*60)
-
-    portas = listar_portas_com()
-
+def _imprimir_portas(portas):
+    """Exibe as portas COM disponíveis e as opções do menu, ou o aviso de que não há nenhuma."""
     if not portas:
+        # O menu continua aberto para permitir reconectar o dispositivo e atualizar
         print("\n[ERRO] Nenhuma porta COM detectada no sistema!")
         print("Verifique se o dispositivo está conectado.")
-        return None
+        return
 
     print("\nPortas COM disponíveis:\n")
     for idx, porta in enumerate(portas, 1):
         descricao = porta.description or "Sem descrição"
         print(f"  [{idx}] {porta.device} - {descricao}")
 
-    print(f"\n  [0] Sair")
-    print("-"*60)
+    print("\n  [R] Atualizar lista")
+    print("  [0] Sair")
+    print(_SEP)
+
+def exibir_menu_portas():
+    """Exibe menu interativo para seleção da porta COM."""
+    print("\n" + _HR)
+    print("  SPEEDUINO TCP PROXY - Configuração")
+    print(_HR)
+
+    portas = listar_portas_com()
+    _imprimir_portas(portas)
 
     while True:
         try:
-            escolha = input("\nEscolha a porta COM [1-{}]: ".format(len(portas)))
+            if portas:
+                escolha = input("\nEscolha a porta COM [1-{}] ou R para atualizar: ".format(len(portas))).strip()
+            else:
+                escolha = input("\nConecte o dispositivo e digite R para atualizar (0 para sair): ").strip()
 
             if escolha == '0':
                 print("\n[SAINDO] Programa encerrado pelo usuário.")
                 return None
 
+            if escolha.lower() == 'r':
+                portas = listar_portas_com()
+                _imprimir_portas(portas)
+                continue
+
+            if not portas:
+                print("[ERRO] Nenhuma porta disponível! Digite R para atualizar ou 0 para sair.")
+                continue
+
             idx = int(escolha) - 1
 
             if 0 <= idx < len(portas):
@@ -145,16 +377,16 @@ def exibir_menu_portas():
                 print(f"[ERRO] Opção inválida! Escolha entre 1 e {len(portas)}")
 
         except ValueError:
-            print("[ERRO] Digite apenas números!")
+            print("[ERRO] Digite o número da porta ou R!")
         except KeyboardInterrupt:
             print("\n\n[SAINDO] Programa encerrado pelo usuário.")
             return None
 
 def configurar_tcp():
     """Permite configurar a porta TCP (opcional)."""
-    print("\n" + "-"*60)
+    print("\n" + _SEP)
     print("  Configuração TCP")
-    print("-"*60)
+    print(_SEP)
 
     usar_padrao = input(f"\nUsar porta TCP padrão {TCP_PORT}? [S/n]: ").strip().lower()
 
@@ -178,14 +410,38 @@ def configurar_tcp():
 
     return TCP_PORT
 
-def start_server(serial_port, tcp_port):
+def _pin_to_single_cpu():
+    """Fixa o processo (e as threads criadas depois) em um único núcleo. Disponível apenas no Linux."""
+    try:
+        # Usa o último núcleo permitido: o núcleo 0 costuma concentrar as interrupções do sistema
+        cpu = max(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpu})
+    except (AttributeError, OSError):
+        return
+    print(f"\n[CPU] Túnel fixado no núcleo {cpu}.")
+
+def start_server(serial_port, tcp_port, *, host=TCP_HOST, baudrate=BAUDRATE, telnet_filter=TELNET_FILTER):
     """Inicia o servidor TCP e a comunicação Serial."""
-    global ser, is_running
+    if not 1 <= tcp_port <= 65535:
+        print(f"\n[ERRO FATAL] Porta TCP inválida: {tcp_port} (use 1-65535).")
+        return
+
+    # Mantém o caminho recv -> filtro -> write no mesmo núcleo, evitando migrações
+    _pin_to_single_cpu()
 
     try:
         # 1. Tenta abrir a porta serial
-        ser = serial.Serial(serial_port, BAUDRATE, timeout=0) # timeout=0 (non-blocking read)
-        print(f"\n[SERIAL] Porta {serial_port} aberta com sucesso (Baudrate: {BAUDRATE}).")
+        # Configura antes de abrir: acesso exclusivo (outro programa não corrompe o fluxo)
+        # e DTR/RTS desativados. No Windows isso evita o pulso de DTR que reinicia o Speeduino;
+        # em POSIX o kernel ativa DTR já no open() (HUPCL) e o pyserial só o desativa depois,
+        # então a abertura ainda pode reiniciar a placa
+        ser = serial.Serial(None, baudrate, timeout=SERIAL_TIMEOUT, exclusive=True, dsrdtr=False, rtscts=False)
+        ser.dtr = False
+        ser.rts = False
+        ser.port = serial_port
+        ser.open()
+        state = TunnelState(ser, _serial_fileno(ser), telnet_filter=telnet_filter)
+        print(f"\n[SERIAL] Porta {serial_port} aberta com sucesso (Baudrate: {baudrate}).")
     except serial.SerialException as e:
         print(f"\n[ERRO FATAL] Não foi possível abrir a porta serial {serial_port}: {e}")
         return
@@ -193,49 +449,98 @@ def start_server(serial_port, tcp_port):
     # 2. Configura o servidor TCP
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        server_socket.bind((TCP_HOST, tcp_port))
-        server_socket.listen(1) # Aceita apenas 1 conexão por vez
-        print(f"[TCP] Servidor escutando em {TCP_HOST}:{tcp_port}...")
-        print("\n" + "="*60)
+        server_socket.bind((host, tcp_port))
+        server_socket.listen(ACCEPT_BACKLOG) # Apenas 1 cliente é atendido por vez
+        print(f"[TCP] Servidor escutando em {host}:{tcp_port}...")
+        print("\n" + _HR)
         print("  PROXY ATIVO - Aguardando conexões...")
         print("  Pressione CTRL+C para encerrar")
-        print("="*60 + "\n")
+        print(_HR + "\n")
     except socket.error as e:
         print(f"[ERRO FATAL] Falha ao iniciar o servidor TCP: {e}")
         ser.close()
         return
 
     # 3. Loop principal de aceitação de conexões
+    wakeup_r = wakeup_w = selector = None
+    previous_wakeup_fd = None
+    client_handler = None
     try:
-        while is_running:
-            # Espera por uma conexão (bloqueante)
-            # Define um timeout para que o loop possa checar 'is_running'
-            server_socket.settimeout(1) 
-            try:
-                conn, addr = server_socket.accept()
-                
-                if tcp_socket:
+        # O handler de sinais escreve em wakeup_w, acordando o select imediatamente
+        # (sockets funcionam como wakeup fd também no Windows)
+        wakeup_r, wakeup_w = socket.socketpair()
+        wakeup_r.setblocking(False)
+        wakeup_w.setblocking(False)
+        try:
+            previous_wakeup_fd = signal.set_wakeup_fd(wakeup_w.fileno())
+        except ValueError:
+            # Fora da thread principal não há sinais a receber: a espera segue só pelo socket
+            pass
+
+        server_socket.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(server_socket, selectors.EVENT_READ)
+        selector.register(wakeup_r, selectors.EVENT_READ)
+
+        while not state.shutdown.is_set():
+            # Espera (sem timeout) por uma conexão ou por um sinal
+            for key, _ in selector.select():
+                if key.fileobj is wakeup_r:
+                    # Um sinal interrompeu a espera: encerra o servidor
+                    state.shutdown.set()
+                    break
+
+                try:
+                    conn, addr = server_socket.accept()
+                except BlockingIOError:
+                    # A conexão pendente foi desfeita antes do accept
+                    continue
+                except Exception as e:
+                    if not state.shutdown.is_set():
+                        print(f"\n[ERRO TCP] Falha ao aceitar conexão: {e}")
+                    state.shutdown.set()
+                    break
+
+                # Recusa aqui mesmo, sem criar thread, se já houver um cliente
+                if state.conn:
                     print(f"\n[TCP] Recusando nova conexão de {addr[0]}:{addr[1]}. Já há um cliente conectado.")
                     conn.close()
                     continue
-                    
+
+                # O socket do servidor é não bloqueante; o do cliente deve bloquear
+                conn.setblocking(True)
+
+                # Registra o cliente antes de iniciar a thread, para que a checagem acima
+                # já recuse uma nova conexão aceita logo em seguida
+                state.conn, state.addr = conn, addr
+
                 # Inicia o tratamento do cliente em uma thread
-                client_handler = threading.Thread(target=handle_tcp_client, args=(conn, addr), name="TCPHandler")
+                client_handler = threading.Thread(target=run_tunnel, args=(state,), name="TCPHandler")
                 client_handler.daemon = True
                 client_handler.start()
 
-            except socket.timeout:
-                # O timeout de 1 segundo expirou, verifica 'is_running'
-                continue
-            except Exception as e:
-                if is_running:
-                    print(f"\n[ERRO TCP] Falha ao aceitar conexão: {e}")
-                break
-
     except KeyboardInterrupt:
         print("\n[INTERRUPÇÃO] Detectado CTRL+C. Encerrando...")
     finally:
-        is_running = False # Sinaliza o encerramento das threads
+        state.shutdown.set() # Sinaliza o encerramento das threads
+        if previous_wakeup_fd is not None:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+        if selector:
+            selector.close()
+        for wakeup_socket in (wakeup_r, wakeup_w):
+            if wakeup_socket:
+                wakeup_socket.close()
+
+        # Acorda a thread do túnel bloqueada no select/recv e aguarda sua finalização,
+        # para não fechar a porta serial enquanto ela ainda está em uso
+        conn = state.conn
+        if conn:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # A thread já fechou o socket
+        if client_handler:
+            client_handler.join(timeout=1)
 
         # 4. Limpeza final
         if ser and ser.is_open:
@@ -257,13 +562,13 @@ if __name__ == '__main__':
     porta_tcp = configurar_tcp()
 
     # Exibe resumo da configuração
-    print("\n" + "="*60)
+    print("\n" + _HR)
     print("  RESUMO DA CONFIGURAÇÃO")
-    print("="*60)
+    print(_HR)
     print(f"  Porta Serial: {porta_com}")
     print(f"  Baudrate:     {BAUDRATE}")
     print(f"  Servidor TCP: {TCP_HOST}:{porta_tcp}")
-    print("="*60)
+    print(_HR)
 
     input("\nPressione ENTER para iniciar o proxy...")
 